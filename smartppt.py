@@ -7,17 +7,48 @@ PPT图片排版脚本 - 多目录独立排版版
 import os
 import sys
 import io
+import queue
 import configparser
+import gc
+import hashlib
+import json
+import re
+import sqlite3
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from PIL import Image, ImageFile
 from pptx import Presentation
-from pptx.util import Cm, Pt
+from pptx.util import Cm, Emu, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
 import math
+from dataclasses import dataclass
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时使用纯 Python 分类
+    np = None
 
 # 修复Pillow处理大图片的问题
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# 页码文本框模板（与 add_textbox 设置字号和颜色后生成的 XML 一致）
+PAGE_NUMBER_XML = (
+    '<p:sp {nsdecls}>'
+    '<p:nvSpPr><p:cNvPr id="{id}" name="TextBox {idx}"/><p:cNvSpPr txBox="1"/><p:nvPr/></p:nvSpPr>'
+    '<p:spPr><a:xfrm><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom><a:noFill/></p:spPr>'
+    '<p:txBody><a:bodyPr wrap="none"><a:spAutoFit/></a:bodyPr><a:lstStyle/>'
+    '<a:p><a:pPr><a:defRPr sz="{sz}"><a:solidFill><a:srgbClr val="{color}"/></a:solidFill></a:defRPr></a:pPr>'
+    '<a:r><a:t>{text}</a:t></a:r></a:p></p:txBody>'
+    '</p:sp>'
+)
+
 def setup_encoding():
     """设置系统编码，解决GBK编码问题"""
     if sys.platform.startswith('win'):
@@ -46,8 +77,6 @@ class ConfigManager:
                 'border_width': '1.0',
                 'show_page_numbers': 'true',
                 'portrait_threshold': '0.9',
-                'square_min_threshold': '0.9',
-                'square_max_threshold': '1.1',
                 'supported_formats': '.jpg, .jpeg, .png, .bmp, .gif, .tiff, .tif, .webp, .jfif'
             }
         }
@@ -134,6 +163,42 @@ class ConfigManager:
             value = self.defaults[section][key]
             return [ext.strip() for ext in value.split(',')]
     
+    def snapshot(self):
+        """读取全部配置并冻结为 ConfigSnapshot"""
+        supported_formats = tuple(self.get_list('SETTINGS', 'supported_formats'))
+        # 预先规范化扩展名集合，便于 O(1) 匹配
+        ext_set = frozenset(
+            ext.lower() if ext.startswith('.') else '.' + ext.lower()
+            for ext in supported_formats if ext
+        )
+        # 扩展名匹配编译为单个正则（C 实现，快于 splitext + 集合查找），编译失败时退回集合匹配
+        try:
+            ext_re = re.compile(
+                '(?:%s)\\Z' % '|'.join(re.escape(ext) for ext in sorted(ext_set, key=len, reverse=True)),
+                re.IGNORECASE
+            ) if ext_set else None
+        except re.error:
+            ext_re = None
+        # 只让 PIL 尝试与支持扩展名对应的解码器，跳过无关格式的探测
+        Image.init()
+        registered = Image.registered_extensions()
+        pil_formats = tuple(sorted({registered[ext] for ext in ext_set if ext in registered})) or None
+        return ConfigSnapshot(
+            image_folders=tuple(self.get_image_folders()),
+            output_path=self.get_output_path(),
+            image_area_ratio=self.get_float('PATHS', 'image_area_ratio'),
+            margin=Emu(Cm(self.get_float('PATHS', 'margin'))),
+            gap=Emu(Cm(self.get_float('PATHS', 'gap'))),
+            show_filenames=self.get_bool('SETTINGS', 'show_filenames'),
+            border_width=Emu(Pt(self.get_float('SETTINGS', 'border_width'))),
+            show_page_numbers=self.get_bool('SETTINGS', 'show_page_numbers'),
+            portrait_threshold=self.get_float('SETTINGS', 'portrait_threshold'),
+            supported_formats=supported_formats,
+            ext_set=ext_set,
+            ext_re=ext_re,
+            pil_formats=pil_formats,
+        )
+
     def get_string(self, section, key):
         """获取字符串配置"""
         try:
@@ -141,22 +206,227 @@ class ConfigManager:
         except (KeyError, configparser.NoSectionError, configparser.NoOptionError):
             return self.defaults[section][key]
 
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """启动时冻结的配置快照，长度类参数已换算为 EMU（可被子进程序列化）
+
+    长度统一保存为 Emu：Cm/Pt 反序列化时会把 EMU 值再按厘米/磅换算一次。
+    """
+    image_folders: tuple
+    output_path: str
+    image_area_ratio: float
+    margin: int
+    gap: int
+    show_filenames: bool
+    border_width: int
+    show_page_numbers: bool
+    portrait_threshold: float
+    supported_formats: tuple
+    ext_set: frozenset
+    ext_re: re.Pattern = None
+    pil_formats: tuple = None
+    cache_path: str = None  # None 表示使用默认缓存位置
+
+class MetadataCache:
+    """图片尺寸缓存（SQLite），以 (路径, 修改时间, 文件大小) 判断文件是否变化"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(os.path.expanduser('~'), '.smartppt_cache.db')
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS images ('
+                'path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, w INTEGER, h INTEGER)'
+            )
+            self.conn.commit()
+        except sqlite3.Error as e:
+            # 缓存不可用时不影响主流程，仅退化为每次重新读取
+            print(f"图片缓存不可用，将直接读取图片: {e}")
+            self.close()
+
+    def lookup(self, path, mtime, size):
+        """查询缓存，命中且文件未变化时返回 (宽, 高)，否则返回 None"""
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute(
+                'SELECT w, h FROM images WHERE path = ? AND mtime = ? AND size = ?',
+                (path, mtime, size)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row
+
+    def store_many(self, rows):
+        """批量写入 (路径, 修改时间, 文件大小, 宽, 高)，单个事务提交"""
+        if self.conn is None or not rows:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO images (path, mtime, size, w, h) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """关闭数据库连接"""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+
+def make_image_info(filepath, width, height):
+    """根据尺寸构建图片信息"""
+    return {
+        'path': filepath,
+        'filename': os.path.basename(filepath),
+        'width': width,
+        'height': height,
+        'ratio': width / height,
+        'success': True
+    }
+
+def robust_read_image(filepath, formats=None):
+    """健壮的图片读取方法，formats 限定 PIL 尝试的解码器"""
+    try:
+        # 只解析文件头获取尺寸，不调用 load() 解码像素
+        with Image.open(filepath, formats=formats) as img:
+            width, height = img.size
+        return make_image_info(filepath, width, height)
+    except Exception:
+        return None
+
+def scan_image_entries(folder_path, ext_set, ext_re=None):
+    """列出文件夹中的图片目录项，按文件名（不区分大小写）排序
+
+    scandir 复用目录项缓存的文件类型，避免额外 stat；其返回顺序不确定，
+    排序后混合页的方/竖配对按文件名顺序进行，多次运行结果一致。
+    """
+    with os.scandir(folder_path) as it:
+        if ext_re is not None:
+            entries = [entry for entry in it if ext_re.search(entry.name) and entry.is_file()]
+        else:
+            entries = [
+                entry for entry in it
+                if entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in ext_set
+            ]
+    entries.sort(key=lambda entry: entry.name.lower())
+    return entries
+
+def scan_image_files(folder_path, cfg):
+    """扫描文件夹，返回 (路径, 修改时间, 大小) 列表
+
+    stat 失败的文件记为 (路径, None, None)；文件夹不存在时抛出 FileNotFoundError。
+    """
+    files = []
+    for entry in scan_image_entries(folder_path, cfg.ext_set, cfg.ext_re):
+        path = os.path.abspath(entry.path)
+        try:
+            st = entry.stat()
+        except OSError:
+            files.append((path, None, None))
+            continue
+        files.append((path, st.st_mtime_ns, st.st_size))
+    return files
+
+def classify_folder(files, cfg):
+    """分类单个文件夹中的图片（模块级函数，便于多进程调用）
+
+    files 为 scan_image_files 的扫描结果，分类时不再重复扫描和 stat。
+    """
+    portraits = []
+    squares = []
+
+    # 1. 先查尺寸缓存，仅对新增或已修改的文件打开图片
+    cache = MetadataCache(cfg.cache_path)
+    results = [None] * len(files)
+    misses = []
+    for index, key in enumerate(files):
+        path, mtime, size = key
+        cached = cache.lookup(path, mtime, size) if mtime is not None else None
+        if cached:
+            results[index] = make_image_info(path, cached[0], cached[1])
+        else:
+            misses.append((index, path, key if mtime is not None else None))
+
+    # 2. 多线程并发读取未命中的图片（I/O密集，线程可重叠磁盘等待）
+    if misses:
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        read_image = partial(robust_read_image, formats=cfg.pil_formats)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            read_results = list(executor.map(read_image, [m[1] for m in misses]))
+        new_rows = []
+        for (index, _, key), img_info in zip(misses, read_results):
+            results[index] = img_info
+            if img_info and key:
+                new_rows.append(key + (img_info['width'], img_info['height']))
+        cache.store_many(new_rows)
+    cache.close()
+
+    # 3. 按原顺序分类
+    metas = [img_info for img_info in results if img_info]
+    failed = len(results) - len(metas)
+    if np is not None and metas:
+        # 向量化计算宽高比并一次性判定竖版
+        sizes = np.array([(m['width'], m['height']) for m in metas], dtype=np.float64)
+        ratios = sizes[:, 0] / sizes[:, 1]
+        portrait_mask = (ratios <= cfg.portrait_threshold).tolist()
+        for img_info, ratio in zip(metas, ratios.tolist()):
+            img_info['ratio'] = ratio
+        portraits = [m for m, is_portrait in zip(metas, portrait_mask) if is_portrait]
+        squares = [m for m, is_portrait in zip(metas, portrait_mask) if not is_portrait]
+    else:
+        for img_info in metas:
+            ratio = img_info['ratio']
+            if ratio <= cfg.portrait_threshold:
+                portraits.append(img_info)
+            else:  # 方形与横版统一归为方/横
+                squares.append(img_info)
+
+    # 大文件夹扫描后主动回收解码器残留对象，控制常驻内存
+    if len(metas) > 1000:
+        gc.collect()
+    return portraits, squares, failed
+
 class SmartPPTGenerator:
-    def __init__(self, config_manager):
-        self.config = config_manager
-        self.output_path = self.config.get_output_path()
-        self.image_area_ratio = self.config.get_float('PATHS', 'image_area_ratio')
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.output_path = cfg.output_path
+        self.image_area_ratio = cfg.image_area_ratio
         self.page_width = Cm(42)
         self.page_height = Cm(29.7)
-        self.margin = Cm(self.config.get_float('PATHS', 'margin'))
-        self.gap = Cm(self.config.get_float('PATHS', 'gap'))
-        self.show_filenames = self.config.get_bool('SETTINGS', 'show_filenames')
-        self.border_width = Pt(self.config.get_float('SETTINGS', 'border_width'))
-        self.show_page_numbers = self.config.get_bool('SETTINGS', 'show_page_numbers')
-        self.supported_formats = tuple(self.config.get_list('SETTINGS', 'supported_formats'))
-        self.portrait_threshold = self.config.get_float('SETTINGS', 'portrait_threshold')
-        self.square_min = self.config.get_float('SETTINGS', 'square_min_threshold')
-        self.square_max = self.config.get_float('SETTINGS', 'square_max_threshold')
+        self.margin = cfg.margin
+        self.gap = cfg.gap
+        self.show_filenames = cfg.show_filenames
+        self.border_width = cfg.border_width
+        self.show_page_numbers = cfg.show_page_numbers
+        self._ext_set = cfg.ext_set
+        self._pil_formats = cfg.pil_formats
+        self.portrait_threshold = cfg.portrait_threshold
+        # 预先计算排版常量，避免每页重复计算
+        self.available_width = self.page_width - (2 * self.margin)
+        self.available_height = self.page_height - (2 * self.margin)
+        self.pagenum_box = (self.page_width - Cm(2.5), self.page_height - Cm(1.0), Cm(2.0), Cm(0.6))
+        self.pagenum_font_size = Pt(8)
+        self.border_rgb = RGBColor(180, 180, 180)
+        self.pagenum_rgb = RGBColor(128, 128, 128)
+        self._pagenum_xml = PAGE_NUMBER_XML.format(
+            nsdecls=nsdecls('p', 'a'),
+            x=self.pagenum_box[0], y=self.pagenum_box[1],
+            cx=self.pagenum_box[2], cy=self.pagenum_box[3],
+            sz=int(self.pagenum_font_size.pt * 100), color=str(self.pagenum_rgb),
+            id='{id}', idx='{idx}', text='{text}'
+        )
+        # 上次生成时的输入签名，输入与排版参数均未变化时跳过重新生成
+        self.state_path = os.path.join(os.path.expanduser('~'), '.smartppt_state.json')
+        # 嵌入图片的目标分辨率：按显示尺寸 300 DPI 缩小超大原图，未超出则嵌入原文件
+        self.embed_dpi = 300
 
     def safe_print(self, *args, **kwargs):
         """安全的打印函数"""
@@ -170,49 +440,151 @@ class SmartPPTGenerator:
             except:
                 print("[编码错误]", **kwargs)
 
-    def robust_read_image(self, filepath):
-        """健壮的图片读取方法"""
-        filename = os.path.basename(filepath)
+    def classify_images_in_folder(self, files):
+        """分类单个文件夹中的图片（files 为 scan_image_files 的扫描结果）"""
+        return classify_folder(files, self.cfg)
+
+    def scan_folders(self, image_folders):
+        """多线程扫描所有文件夹，返回 {文件夹: 扫描结果}，不存在的文件夹为 None
+
+        扫描结果同时用于输入签名和分类，每个文件只 stat 一次。
+        """
+        def scan(folder_path):
+            try:
+                return scan_image_files(folder_path, self.cfg)
+            except FileNotFoundError:
+                return None
+
+        unique_folders = list(dict.fromkeys(image_folders))
+        max_workers = min(32, len(unique_folders))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(unique_folders, executor.map(scan, unique_folders)))
+
+    def input_signature(self, image_folders, folder_files):
+        """计算所有输入图片 (路径, 修改时间, 大小) 与排版参数的签名"""
+        files = []
+        for folder_path in image_folders:
+            folder = folder_files[folder_path]
+            if folder is None:
+                files.append([folder_path, None])
+                continue
+            files.extend(list(f) for f in folder if f[1] is not None)
+        layout = [
+            image_folders, self.image_area_ratio, self.margin, self.gap, self.show_filenames,
+            self.border_width, self.show_page_numbers, self.portrait_threshold,
+            sorted(self._ext_set), self.embed_dpi,
+        ]
+        payload = json.dumps([sorted(files, key=str), layout], ensure_ascii=False)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def load_state(self):
+        """读取生成状态文件"""
         try:
-            with Image.open(filepath) as img:
-                img.load()
-                return {
-                    'path': filepath,
-                    'filename': filename,
-                    'width': img.size[0],
-                    'height': img.size[1],
-                    'ratio': img.size[0] / img.size[1],
-                    'success': True
-                }
-        except Exception:
-            return None
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def is_up_to_date(self, signature):
+        """输出文件存在、未被改动且输入签名一致时返回 True"""
+        record = self.load_state().get(self.output_path)
+        if not isinstance(record, dict) or record.get('signature') != signature:
+            return False
+        try:
+            st = os.stat(self.output_path)
+        except OSError:
+            return False
+        return record.get('output_mtime') == st.st_mtime_ns and record.get('output_size') == st.st_size
 
-    def classify_images_in_folder(self, folder_path):
-        """分类单个文件夹中的图片"""
-        portraits = []
-        squares = []
-        failed = 0
-
-        for filename in os.listdir(folder_path):
-            if any(filename.lower().endswith(ext) for ext in self.supported_formats):
-                filepath = os.path.join(folder_path, filename)
-                img_info = self.robust_read_image(filepath)
-                if img_info:
-                    ratio = img_info['ratio']
-                    if ratio <= self.portrait_threshold:
-                        portraits.append(img_info)
-                    elif self.square_min < ratio < self.square_max:
-                        squares.append(img_info)
-                    else:  # 横版归为方形
-                        squares.append(img_info)
-                else:
-                    failed += 1
-        return portraits, squares, failed
+    def save_state(self, signature):
+        """记录本次生成的输入签名及输出文件状态"""
+        try:
+            st = os.stat(self.output_path)
+            state = self.load_state()
+            state[self.output_path] = {
+                'signature': signature,
+                'output_mtime': st.st_mtime_ns,
+                'output_size': st.st_size,
+            }
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+        except (OSError, ValueError):
+            pass
+
+    def iter_folder_results(self, image_folders, folder_files):
+        """按配置顺序逐个产出 (文件夹, future)，分类在后台提前进行
+
+        多个文件夹时提交到进程池并行分类；单个文件夹或无法启用多进程时，
+        由后台线程按顺序预取，当前文件夹排版期间即开始分类下一个文件夹。
+        不存在的文件夹产出的 future 为 None。
+        """
+        existing = [fp for fp in dict.fromkeys(image_folders) if folder_files[fp] is not None]
+        executor = None
+        if len(existing) > 1:
+            try:
+                executor = ProcessPoolExecutor(max_workers=min(len(existing), os.cpu_count() or 1))
+                futures = {fp: executor.submit(classify_folder, folder_files[fp], self.cfg) for fp in existing}
+            except (OSError, NotImplementedError) as e:
+                # 环境不支持多进程时退化为后台线程顺序预取
+                self.safe_print(f"  提示: 无法启用多进程分类，改为顺序处理 ({e})")
+                if executor is not None:
+                    executor.shutdown()
+                executor = None
+
+        if executor is not None:
+            try:
+                for folder_path in image_folders:
+                    yield folder_path, futures.get(folder_path)
+            finally:
+                executor.shutdown(cancel_futures=True)
+            return
+
+        results = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._prefetch_folders, args=(image_folders, folder_files, results, stop), daemon=True
+        )
+        producer.start()
+        try:
+            for _ in image_folders:
+                yield results.get()
+        finally:
+            stop.set()
+            # 清空队列，避免预取线程阻塞在 put 上
+            while not results.empty():
+                results.get_nowait()
+
+    def _prefetch_folders(self, image_folders, folder_files, results, stop):
+        """后台线程：按顺序分类文件夹并放入有界队列"""
+        for folder_path in image_folders:
+            if stop.is_set():
+                return
+            files = folder_files[folder_path]
+            if files is None:
+                results.put((folder_path, None))
+                continue
+            future = Future()
+            try:
+                future.set_result(self.classify_images_in_folder(files))
+            except Exception as e:
+                future.set_exception(e)
+            results.put((folder_path, future))
+
+    def collect_folder_result(self, files, future):
+        """取文件夹分类结果；子进程异常退出时改为在当前进程分类"""
+        if future is not None:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                # 如打包程序或 pythonw 下子进程无法正常启动
+                self.safe_print("  提示: 分类子进程异常退出，改为在当前进程处理。")
+        return self.classify_images_in_folder(files)
 
     def create_mixed_slide(self, slide, square_img, portrait_img):
         """创建混合页面（1方+1竖）"""
-        available_width = self.page_width - (2 * self.margin)
-        available_height = self.page_height - (2 * self.margin)
+        available_width = self.available_width
+        available_height = self.available_height
         unified_height = available_height * self.image_area_ratio
 
         square_width = unified_height * square_img['ratio']
@@ -235,8 +607,8 @@ class SmartPPTGenerator:
 
     def create_portrait_slide(self, slide, portrait_imgs):
         """创建纯竖版页面（3张竖版）"""
-        available_width = self.page_width - (2 * self.margin)
-        available_height = self.page_height - (2 * self.margin)
+        available_width = self.available_width
+        available_height = self.available_height
         unified_height = available_height * self.image_area_ratio
 
         image_widths = [unified_height * img['ratio'] for img in portrait_imgs]
@@ -271,35 +643,87 @@ class SmartPPTGenerator:
             left_c = left + (width - new_width) / 2
             top_c = top + (height - new_height) / 2
 
-            pic = slide.shapes.add_picture(img_info['path'], left_c, top_c, new_width, new_height)
+            target_size = self.embed_target_size(img_info, new_width, new_height)
+            image_source = self.prepare_image_source(img_info, target_size)
+            # python-pptx 按完整内容的 SHA1 复用相同的图片部件，重复图片只嵌入一次
+            pic = slide.shapes.add_picture(image_source, left_c, top_c, new_width, new_height)
+            # 缩小后的图片以内存缓冲区嵌入，python-pptx 只能记为 image.jpg，这里改回原文件名
+            pic._element.nvPicPr.cNvPr.set('descr', img_info['filename'])
             if self.border_width.pt > 0:
                 pic.line.width = self.border_width
-                pic.line.color.rgb = RGBColor(180, 180, 180)
+                pic.line.color.rgb = self.border_rgb
             return True
         except Exception as e:
             self.safe_print(f"  添加图片失败 {img_info['filename']}: {e}")
             return False
 
+    def embed_target_size(self, img_info, width, height):
+        """计算显示尺寸对应的嵌入像素尺寸，原图未超出时返回 None（直接嵌入原文件）"""
+        target_w = max(1, int(width * self.embed_dpi / 914400))
+        target_h = max(1, int(height * self.embed_dpi / 914400))
+        if img_info['width'] <= target_w and img_info['height'] <= target_h:
+            return None
+        return target_w, target_h
+
+    def prepare_image_source(self, img_info, target_size):
+        """按嵌入尺寸缩小超大图片，返回文件路径或内存缓冲区"""
+        path = img_info['path']
+        if target_size is None:
+            return path
+        with Image.open(path, formats=self._pil_formats) as img:
+            # 保留色彩配置和 EXIF（含方向），缩小后的显示效果与原图一致
+            save_kwargs = {key: img.info[key] for key in ('icc_profile', 'exif') if img.info.get(key)}
+            # thumbnail() 会先对 JPEG 调用 draft()，按 DCT 缩放比例直接解码缩小的图像
+            img.thumbnail(target_size, Image.LANCZOS)
+            buf = io.BytesIO()
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                # 保留透明通道
+                img.save(buf, format='PNG', optimize=True, **save_kwargs)
+            else:
+                rgb = img if img.mode == 'RGB' else img.convert('RGB')
+                if rgb is not img:
+                    # 色彩模式已转换，原色彩配置不再适用
+                    save_kwargs.pop('icc_profile', None)
+                rgb.save(buf, format='JPEG', quality=88, optimize=True, **save_kwargs)
+                if rgb is not img:
+                    rgb.close()
+        buf.seek(0)
+        return buf
+
     def add_page_number(self, slide, page_num):
         """添加页码"""
         if not self.show_page_numbers:
             return
         try:
-            txBox = slide.shapes.add_textbox(self.page_width - Cm(2.5), self.page_height - Cm(1.0), Cm(2.0), Cm(0.6))
-            tf = txBox.text_frame
-            tf.text = f"{page_num}"
-            tf.paragraphs[0].font.size = Pt(8)
-            tf.paragraphs[0].font.color.rgb = RGBColor(128, 128, 128)
+            # 直接套用预生成的文本框 XML，避免每页调用文本框/字体/颜色构建接口
+            shapes = slide.shapes
+            shape_id = shapes._next_shape_id
+            sp = parse_xml(self._pagenum_xml.format(id=shape_id, idx=shape_id - 1, text=page_num))
+            shapes._spTree.append(sp)
+        except:
+            pass
+
+    def open_file(self, path):
+        """用系统默认程序打开文件"""
+        try:
+            os.startfile(path)
         except:
             pass
 
     def generate_ppt(self):
         """生成PPT - 核心修改：按文件夹独立处理"""
-        image_folders = self.config.get_image_folders()
+        image_folders = list(self.cfg.image_folders)
         if not image_folders:
             self.safe_print("错误: 未在配置中找到有效的图片文件夹路径。")
             return
 
+        # 只扫描一次文件夹，签名与分类共用扫描结果
+        folder_files = self.scan_folders(image_folders)
+        signature = self.input_signature(image_folders, folder_files)
+        if self.is_up_to_date(signature):
+            self.safe_print(f"图片与排版设置均未变化，跳过生成: {self.output_path}")
+            return
+
         prs = Presentation()
         prs.slide_width = self.page_width
         prs.slide_height = self.page_height
@@ -312,58 +736,64 @@ class SmartPPTGenerator:
         self.safe_print("开始按文件夹顺序独立排版...")
         self.safe_print("=" * 70)
 
-        for folder_index, folder_path in enumerate(image_folders):
-            folder_name = os.path.basename(os.path.normpath(folder_path))
-            self.safe_print(f"\n>>> 正在处理第 {folder_index + 1} 个文件夹: {folder_name}")
+        # 分类在后台提前进行（多进程或预取线程），排版仍严格按文件夹顺序进行
+        folder_results = self.iter_folder_results(image_folders, folder_files)
+        try:
+            for folder_index, (folder_path, future) in enumerate(folder_results):
+                folder_name = os.path.basename(os.path.normpath(folder_path))
+                self.safe_print(f"\n>>> 正在处理第 {folder_index + 1} 个文件夹: {folder_name}")
 
-            if not os.path.exists(folder_path):
-                self.safe_print(f"  警告: 文件夹不存在，跳过。")
-                folder_summary.append((folder_name, "文件夹不存在", 0))
-                continue
+                files = folder_files[folder_path]
+                if files is None:
+                    self.safe_print(f"  警告: 文件夹不存在，跳过。")
+                    folder_summary.append((folder_name, "文件夹不存在", 0))
+                    continue
 
-            # 1. 分类当前文件夹的图片
-            portraits, squares, failed = self.classify_images_in_folder(folder_path)
-            total_imgs = len(portraits) + len(squares)
+                # 1. 取当前文件夹的分类结果
+                portraits, squares, failed = self.collect_folder_result(files, future)
+                total_imgs = len(portraits) + len(squares)
 
-            self.safe_print(f"  扫描结果: 共 {total_imgs} 张可用图片 ({len(portraits)} 竖, {len(squares)} 方/横), {failed} 张读取失败。")
+                self.safe_print(f"  扫描结果: 共 {total_imgs} 张可用图片 ({len(portraits)} 竖, {len(squares)} 方/横), {failed} 张读取失败。")
 
-            if total_imgs == 0:
-                self.safe_print(f"  提示: 文件夹内无可用图片，跳过。")
-                folder_summary.append((folder_name, "无图片", 0))
-                continue
+                if total_imgs == 0:
+                    self.safe_print(f"  提示: 文件夹内无可用图片，跳过。")
+                    folder_summary.append((folder_name, "无图片", 0))
+                    continue
+
+                # 2. 处理当前文件夹的图片
+                folder_slide_count = 0
+                square_idx, portrait_idx = 0, 0
 
-            # 2. 处理当前文件夹的图片
-            folder_slide_count = 0
-            square_idx, portrait_idx = 0, 0
-
-            # 2.1 先排混合页 (1方 + 1竖)
-            while square_idx < len(squares) and portrait_idx < len(portraits):
-                slide = prs.slides.add_slide(blank_layout)
-                total_slide_count += 1
-                folder_slide_count += 1
-                self.create_mixed_slide(slide, squares[square_idx], portraits[portrait_idx])
-                self.add_page_number(slide, total_slide_count)
-                square_idx += 1
-                portrait_idx += 1
-
-            # 2.2 再排剩余的竖版图片 (3张一页)
-            remaining_portraits = len(portraits) - portrait_idx
-            if remaining_portraits > 0:
-                portrait_groups = math.ceil(remaining_portraits / 3)
-                for group in range(portrait_groups):
+                # 2.1 先排混合页 (1方 + 1竖)
+                while square_idx < len(squares) and portrait_idx < len(portraits):
                     slide = prs.slides.add_slide(blank_layout)
                     total_slide_count += 1
                     folder_slide_count += 1
-                    start = portrait_idx + (group * 3)
-                    end = min(start + 3, len(portraits))
-                    self.create_portrait_slide(slide, portraits[start:end])
+                    self.create_mixed_slide(slide, squares[square_idx], portraits[portrait_idx])
                     self.add_page_number(slide, total_slide_count)
-
-            # 记录当前文件夹的统计
-            unused_squares = len(squares) - square_idx
-            status_note = f"已用 {min(len(squares), len(portraits))} 方" + (f", {unused_squares} 方未匹配" if unused_squares > 0 else "")
-            folder_summary.append((folder_name, status_note, folder_slide_count))
-            self.safe_print(f"  完成: 生成了 {folder_slide_count} 页。{status_note}")
+                    square_idx += 1
+                    portrait_idx += 1
+
+                # 2.2 再排剩余的竖版图片 (3张一页)
+                remaining_portraits = len(portraits) - portrait_idx
+                if remaining_portraits > 0:
+                    portrait_groups = math.ceil(remaining_portraits / 3)
+                    for group in range(portrait_groups):
+                        slide = prs.slides.add_slide(blank_layout)
+                        total_slide_count += 1
+                        folder_slide_count += 1
+                        start = portrait_idx + (group * 3)
+                        end = min(start + 3, len(portraits))
+                        self.create_portrait_slide(slide, portraits[start:end])
+                        self.add_page_number(slide, total_slide_count)
+
+                # 记录当前文件夹的统计
+                unused_squares = len(squares) - square_idx
+                status_note = f"已用 {min(len(squares), len(portraits))} 方" + (f", {unused_squares} 方未匹配" if unused_squares > 0 else "")
+                folder_summary.append((folder_name, status_note, folder_slide_count))
+                self.safe_print(f"  完成: 生成了 {folder_slide_count} 页。{status_note}")
+        finally:
+            folder_results.close()
 
         # 3. 保存并输出总结果
         self.safe_print("\n" + "=" * 70)
@@ -375,15 +805,16 @@ class SmartPPTGenerator:
         self.safe_print(f"PPT总页数: {total_slide_count}")
 
         try:
-            prs.save(self.output_path)
+            # 使用大缓冲区写入，减少大文件的写系统调用次数
+            with open(self.output_path, 'wb', buffering=4 * 1024 * 1024) as f:
+                prs.save(f)
+            self.save_state(signature)
             file_size = os.path.getsize(self.output_path)
             self.safe_print(f"文件已保存: {os.path.abspath(self.output_path)} ({file_size/1024/1024:.1f} MB)")
             if sys.platform.startswith('win') and os.path.exists(self.output_path):
-                try:
-                    os.startfile(self.output_path)
-                    self.safe_print("已尝试自动打开PPT文件。")
-                except:
-                    pass
+                # 在后台线程中打开文件，避免等待外部程序启动
+                threading.Thread(target=self.open_file, args=(self.output_path,), daemon=True).start()
+                self.safe_print("已尝试自动打开PPT文件。")
         except Exception as e:
             self.safe_print(f"\n保存PPT时出错: {e}")
 
@@ -396,9 +827,10 @@ def main():
     print(f"将按顺序处理 {len(config_manager.get_image_folders())} 个文件夹。")
     print("=" * 70)
     input("按回车键开始...")
-    generator = SmartPPTGenerator(config_manager)
+    generator = SmartPPTGenerator(config_manager.snapshot())
     generator.generate_ppt()
     input("\n按回车键退出...")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file